@@ -0,0 +1,63 @@
+"""
+Disk cache for OpenAI responses.
+
+Cleanup and segmentation give the same answer for the same model, prompt
+and transcript, so retries and re-runs reuse earlier results from
+output/.cache instead of paying for another request.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+
+CACHE_DIR = Path(__file__).parent.parent / "output" / ".cache"
+
+
+def cache_key(*parts: str) -> str:
+    """Build a cache key from the inputs that determine a response."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def cache_get(namespace: str, key: str, suffix: str = ".txt") -> str | None:
+    """
+    Look up a cached response.
+
+    Args:
+        namespace: Cache subdirectory (e.g. 'cleanup', 'segment')
+        key: Key from cache_key()
+        suffix: File extension for the cached value
+
+    Returns:
+        The cached value, or None if it isn't cached
+    """
+    path = CACHE_DIR / namespace / f"{key}{suffix}"
+    try:
+        return path.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def cache_put(namespace: str, key: str, value: str, suffix: str = ".txt") -> None:
+    """
+    Store a response in the cache.
+
+    Writes to a temp file and renames it into place, so concurrent workers
+    and interrupted runs never leave a partial entry behind.
+    """
+    directory = CACHE_DIR / namespace
+    directory.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(value)
+        os.replace(tmp_path, directory / f"{key}{suffix}")
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
@@ -5,21 +5,23 @@ Polishes raw sermon transcripts by fixing transcription errors,
 adding proper punctuation, paragraph breaks, and removing filler words.
 """
 
-import os
-import json
+from contextlib import nullcontext
 from pathlib import Path
 
+import orjson
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from cache import cache_get, cache_key, cache_put
+from openai_client import get_client, parse_stream_line
+from ratelimit import estimate_tokens
+from segment import SERVICE_DESCRIPTION
+
 # Load .env from project root
 load_dotenv(Path(__file__).parent.parent / ".env")
 
 
-SYSTEM_PROMPT = """You are an expert editor specializing in religious sermon transcripts. Your task is to clean up a raw speech-to-text transcript and produce a polished, readable version.
-
-Instructions:
-1. Fix transcription errors (e.g., "Maygai" should be "Magi", phonetic misspellings)
+CLEANUP_INSTRUCTIONS = """1. Fix transcription errors (e.g., "Maygai" should be "Magi", phonetic misspellings)
 2. Add proper punctuation and capitalization
 3. Break into logical paragraphs (every 3-5 sentences or at natural topic shifts)
 4. Remove filler words ("um", "uh", "you know", false starts)
@@ -27,30 +29,119 @@ Instructions:
 6. Preserve the speaker's voice and style - don't rewrite, just clean up
 7. Keep all scripture references and theological terms accurate
 8. Do NOT add content that wasn't in the original
-9. Do NOT remove meaningful content
+9. Do NOT remove meaningful content"""
+
+SYSTEM_PROMPT = f"""You are an expert editor specializing in religious sermon transcripts. Your task is to clean up a raw speech-to-text transcript and produce a polished, readable version.
+
+Instructions:
+{CLEANUP_INSTRUCTIONS}
 
 Output the cleaned transcript as plain text with proper paragraphs. Do not include any commentary or notes - just the cleaned sermon text."""
 
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+
+You may be given several sermons at once, each introduced by a <<<SERMON N>>> marker. Clean up each sermon independently and return your response as JSON with this exact format:
+{
+  "sermons": ["cleaned text of sermon 1", "cleaned text of sermon 2"]
+}
+
+The "sermons" array must contain exactly one entry per input sermon, in the same order."""
+
+# Upper bound on estimated input tokens per batched request. The cleaned
+# output is roughly the same size as the input, so this is sized to fit the
+# model's completion limit (16k tokens for gpt-4o-mini), not its context.
+BATCH_TOKEN_LIMIT = 12_000
+
+SEGMENT_AND_CLEANUP_PROMPT = f"""You are an expert editor specializing in religious sermon transcripts. Your task is to find the sermon in a church service transcript and produce a polished, readable version of it.
+
+{SERVICE_DESCRIPTION}
+
+First, identify where the sermon begins and ends in the timestamped transcript. Then clean up the sermon portion (without timestamps) following these instructions:
+{CLEANUP_INSTRUCTIONS}
+""" + """
+Return your response as JSON with this exact format:
+{
+  "sermon_start": "HH:MM:SS",
+  "sermon_end": "HH:MM:SS",
+  "confidence": "high|medium|low",
+  "reasoning": "Brief explanation of why you identified these boundaries",
+  "cleaned_text": "The cleaned sermon as plain text, with paragraphs separated by blank lines"
+}
+
+If you cannot identify a clear sermon, return:
+{
+  "sermon_start": null,
+  "sermon_end": null,
+  "confidence": "low",
+  "reasoning": "Explanation of why sermon could not be identified",
+  "cleaned_text": null
+}"""
+
+
+def _cleanup_cache_key(sermon_text: str, model: str) -> str:
+    return cache_key(model, SYSTEM_PROMPT, sermon_text)
+
+
+def _stream_completion(client: OpenAI, **kwargs):
+    # Yield (content, finish_reason) for each chunk of a streamed completion,
+    # reading the body to the end (see parse_stream_line())
+    with client.chat.completions.with_streaming_response.create(stream=True, **kwargs) as response:
+        for line in response.iter_lines():
+            choice = parse_stream_line(line, response.http_request)
+            if choice is not None:
+                yield choice["delta"].get("content") or "", choice.get("finish_reason")
+
+
+def _read_completion(client: OpenAI, **kwargs) -> tuple[str, str | None]:
+    # Stream a completion and return its text and finish reason. Streaming
+    # keeps the read timeout between chunks, so long JSON responses don't
+    # need a timeout as long as the whole generation.
+    parts = []
+    finish_reason = None
+    for piece, reason in _stream_completion(client, **kwargs):
+        parts.append(piece)
+        finish_reason = reason or finish_reason
+    return "".join(parts), finish_reason
+
 
 def cleanup_sermon(
     sermon_text: str,
     model: str = "gpt-4o-mini",
-    api_key: str | None = None
+    api_key: str | None = None,
+    use_cache: bool = True,
+    output_path: str | None = None
 ) -> str:
     """
     Clean up a raw sermon transcript.
 
+    The response is streamed, so when output_path is given the cleaned text
+    is written to disk as it arrives instead of after the whole completion.
+
     Args:
         sermon_text: Raw transcript text
         model: OpenAI model to use
         api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        use_cache: Reuse a previous result for the same text and model
+        output_path: Optional file to write the cleaned text to
 
     Returns:
         Cleaned transcript as a string
+
+    Raises:
+        ValueError: If the response is truncated
     """
-    client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+    key = _cleanup_cache_key(sermon_text, model)
+    if use_cache:
+        cached = cache_get("cleanup", key)
+        if cached is not None:
+            if output_path:
+                save_cleaned_sermon(cached, output_path)
+            return cached
+
+    client = get_client(api_key)
 
-    response = client.chat.completions.create(
+    stream = _stream_completion(
+        client,
         model=model,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
@@ -59,7 +150,174 @@ def cleanup_sermon(
         temperature=0.3
     )
 
-    return response.choices[0].message.content
+    parts = []
+    try:
+        with open(output_path, "w", buffering=1) if output_path else nullcontext() as f:
+            for piece, finish_reason in stream:
+                parts.append(piece)
+                if f:
+                    f.write(piece)
+                if finish_reason == "length":
+                    raise ValueError("Cleanup response was truncated")
+    except BaseException:
+        # Don't leave a truncated transcript that looks finished
+        if output_path:
+            Path(output_path).unlink(missing_ok=True)
+        raise
+
+    cleaned = "".join(parts)
+    if use_cache:
+        cache_put("cleanup", key, cleaned)
+    return cleaned
+
+
+def group_for_batching(
+    texts: list[str],
+    max_tokens: int = BATCH_TOKEN_LIMIT
+) -> list[list[int]]:
+    """
+    Group sermon texts into batches that fit in a single cleanup request.
+
+    Args:
+        texts: Raw transcript texts
+        max_tokens: Maximum estimated input tokens per batch
+
+    Returns:
+        List of batches, each a list of indices into texts. A text larger
+        than max_tokens gets a batch of its own.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+def cleanup_sermons_batch(
+    texts: list[str],
+    model: str = "gpt-4o-mini",
+    api_key: str | None = None,
+    use_cache: bool = True
+) -> list[str]:
+    """
+    Clean up several raw sermon transcripts in a single request.
+
+    Args:
+        texts: Raw transcript texts
+        model: OpenAI model to use
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        use_cache: Reuse previous results and only send uncached texts
+
+    Returns:
+        Cleaned transcripts, in the same order as texts
+
+    Raises:
+        ValueError: If the response is truncated or doesn't contain one
+            cleaned transcript per input
+    """
+    keys = [_cleanup_cache_key(text, model) for text in texts]
+    cleaned = [cache_get("cleanup", key) if use_cache else None for key in keys]
+
+    missing = [i for i, text in enumerate(cleaned) if text is None]
+    if len(missing) <= 1:
+        for i in missing:
+            cleaned[i] = cleanup_sermon(texts[i], model=model, api_key=api_key, use_cache=use_cache)
+        return cleaned
+
+    client = get_client(api_key)
+
+    sermons = "\n\n".join(
+        f"<<<SERMON {n}>>>\n{texts[i]}" for n, i in enumerate(missing, start=1)
+    )
+
+    content, finish_reason = _read_completion(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Please clean up these {len(missing)} sermon transcripts:\n\n{sermons}"}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.3
+    )
+    if finish_reason == "length":
+        raise ValueError("Batched cleanup response was truncated")
+
+    results = orjson.loads(content).get("sermons")
+    if not isinstance(results, list) or len(results) != len(missing):
+        count = len(results) if isinstance(results, list) else 0
+        raise ValueError(f"Expected {len(missing)} cleaned sermons, got {count}")
+
+    for i, text in zip(missing, results):
+        cleaned[i] = text
+        if use_cache:
+            cache_put("cleanup", keys[i], text)
+
+    return cleaned
+
+
+def segment_and_cleanup(
+    transcript_text: str,
+    model: str = "gpt-4o-mini",
+    api_key: str | None = None,
+    use_cache: bool = True
+) -> dict:
+    """
+    Find the sermon in a service transcript and clean it up in one request.
+
+    Saves a round trip, and re-sending the sermon text, compared with
+    segment_transcript() followed by cleanup_sermon().
+
+    Args:
+        transcript_text: Timestamped transcript text
+        model: OpenAI model to use
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        use_cache: Reuse a previous result for the same transcript and model
+
+    Returns:
+        dict with sermon_start, sermon_end, confidence, reasoning and
+        cleaned_text (null when no sermon was found)
+
+    Raises:
+        ValueError: If the response is truncated
+    """
+    key = cache_key(model, SEGMENT_AND_CLEANUP_PROMPT, transcript_text)
+    if use_cache:
+        cached = cache_get("segment_cleanup", key, suffix=".json")
+        if cached is not None:
+            return orjson.loads(cached)
+
+    client = get_client(api_key)
+
+    content, finish_reason = _read_completion(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": SEGMENT_AND_CLEANUP_PROMPT},
+            {"role": "user", "content": f"Here is the church service transcript:\n\n{transcript_text}"}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.3
+    )
+    if finish_reason == "length":
+        raise ValueError("Segment and cleanup response was truncated")
+
+    result = orjson.loads(content)
+    if use_cache:
+        cache_put("segment_cleanup", key, content, suffix=".json")
+    return result
 
 
 def save_cleaned_sermon(
@@ -100,8 +358,8 @@ if __name__ == "__main__":
         output_file = sermon_file.replace("_sermon.json", "_cleaned.txt").replace(".json", "_cleaned.txt")
 
     # Load sermon
-    with open(sermon_file) as f:
-        data = json.load(f)
+    with open(sermon_file, "rb") as f:
+        data = orjson.loads(f.read())
 
     # Get the text - handle both formats
     if isinstance(data, dict) and "text" in data:
@@ -114,12 +372,10 @@ if __name__ == "__main__":
     print(f"Cleaning sermon with {model}...")
     print(f"Input length: {len(sermon_text.split())} words")
 
-    cleaned = cleanup_sermon(sermon_text, model=model)
+    # Streams straight into the output file
+    cleaned = cleanup_sermon(sermon_text, model=model, output_path=output_file)
 
     print(f"Output length: {len(cleaned.split())} words")
-
-    # Save to file
-    save_cleaned_sermon(cleaned, output_file)
     print(f"\nCleaned sermon saved to: {output_file}")
 
     # Also print preview
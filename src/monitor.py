@@ -4,25 +4,29 @@ YouTube channel monitor using yt-dlp.
 Checks for new video uploads and triggers the pipeline when detected.
 """
 
-import json
 import os
-import subprocess
+import re
 from pathlib import Path
 from datetime import datetime, timezone
 
+import orjson
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError
+
 
 STATE_FILE = Path(__file__).parent.parent / "state.json"
 
+# Spaces become underscores, unsafe characters are dropped (one C-level pass)
+_FILENAME_TRANS = str.maketrans({" ": "_", **dict.fromkeys('<>:"/\\|?*')})
+_MULTI_UNDERSCORE = re.compile(r'_+')
+
 
 def sanitize_filename(title: str) -> str:
     """Convert title to safe filename format."""
-    import re
-    # Replace spaces with underscores
-    safe = title.replace(" ", "_")
-    # Remove or replace unsafe characters
-    safe = re.sub(r'[<>:"/\\|?*]', '', safe)
+    # Replace spaces with underscores and remove unsafe characters
+    safe = title.translate(_FILENAME_TRANS)
     # Remove multiple underscores
-    safe = re.sub(r'_+', '_', safe)
+    safe = _MULTI_UNDERSCORE.sub('_', safe)
     # Remove leading/trailing underscores
     safe = safe.strip('_')
     # Limit length
@@ -56,60 +60,51 @@ def fetch_latest_videos(channel_id: str, limit: int = 5) -> list[dict]:
     tabs = ["/videos", "/streams"]
     all_videos = {}  # Use dict to dedupe by video_id
 
-    for tab in tabs:
-        channel_url = base_url + tab
-        try:
-            result = subprocess.run(
-                [
-                    "yt-dlp",
-                    "--flat-playlist",
-                    "--print", "%(id)s\t%(title)s\t%(upload_date)s",
-                    "--playlist-end", str(limit),
-                    channel_url
-                ],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-
-            if result.returncode != 0:
-                print(f"Warning: Failed to fetch {tab}: {result.stderr}")
+    # One YoutubeDL instance for both tabs so extractor state and HTTP
+    # connections are shared (equivalent to `yt-dlp --flat-playlist`)
+    ydl_opts = {
+        "extract_flat": "in_playlist",
+        "playlistend": limit,
+        "socket_timeout": 60,
+        "quiet": True,
+        "no_warnings": True,
+    }
+
+    with YoutubeDL(ydl_opts) as ydl:
+        for tab in tabs:
+            channel_url = base_url + tab
+            try:
+                info = ydl.extract_info(channel_url, download=False)
+            except DownloadError as e:
+                print(f"Warning: Failed to fetch {tab}: {e}")
                 continue
 
-            for line in result.stdout.strip().split("\n"):
-                if "\t" in line:
-                    parts = line.split("\t")
-                    if len(parts) >= 3:
-                        video_id, title, upload_date = parts[0], parts[1], parts[2]
-                    else:
-                        video_id, title, upload_date = parts[0], parts[1] if len(parts) > 1 else "", "NA"
-
-                    # Skip if already seen
-                    if video_id in all_videos:
-                        continue
-
-                    # Format date as YYYY-MM-DD
-                    if upload_date and upload_date != "NA" and len(upload_date) == 8:
-                        formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:8]}"
-                    else:
-                        formatted_date = upload_date
-
-                    # Sanitize title for filename
-                    safe_title = sanitize_filename(title)
-
-                    all_videos[video_id] = {
-                        "video_id": video_id,
-                        "title": title,
-                        "safe_title": safe_title,
-                        "upload_date": formatted_date,
-                        "url": f"https://www.youtube.com/watch?v={video_id}"
-                    }
-
-        except subprocess.TimeoutExpired:
-            print(f"Warning: Timeout fetching {tab}")
-            continue
-        except FileNotFoundError:
-            raise RuntimeError("yt-dlp not found - please install it")
+            for entry in info.get("entries") or []:
+                video_id = entry.get("id")
+
+                # Skip if missing or already seen
+                if not video_id or video_id in all_videos:
+                    continue
+
+                title = entry.get("title") or ""
+                upload_date = entry.get("upload_date") or "NA"
+
+                # Format date as YYYY-MM-DD
+                if upload_date and upload_date != "NA" and len(upload_date) == 8:
+                    formatted_date = f"{upload_date[:4]}-{upload_date[4:6]}-{upload_date[6:8]}"
+                else:
+                    formatted_date = upload_date
+
+                # Sanitize title for filename
+                safe_title = sanitize_filename(title)
+
+                all_videos[video_id] = {
+                    "video_id": video_id,
+                    "title": title,
+                    "safe_title": safe_title,
+                    "upload_date": formatted_date,
+                    "url": f"https://www.youtube.com/watch?v={video_id}"
+                }
 
     return list(all_videos.values())
 
@@ -117,16 +112,17 @@ def fetch_latest_videos(channel_id: str, limit: int = 5) -> list[dict]:
 def load_state() -> dict:
     """Load the state file containing last processed video."""
     if STATE_FILE.exists():
-        with open(STATE_FILE) as f:
-            return json.load(f)
+        with open(STATE_FILE, "rb") as f:
+            return orjson.loads(f.read())
     return {"last_video_id": None, "last_check": None}
 
 
 def save_state(state: dict) -> None:
     """Save the state file."""
     state["last_check"] = datetime.now(timezone.utc).isoformat()
-    with open(STATE_FILE, "w") as f:
-        json.dump(state, f, indent=2)
+    # Indented: state.json is committed and read by people
+    with open(STATE_FILE, "wb") as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
 
 
 def check_for_new_videos(channel_id: str) -> list[dict]:
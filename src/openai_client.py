@@ -0,0 +1,125 @@
+"""
+Shared OpenAI client.
+
+Segmentation and cleanup reuse one client per API key (and, for the async
+client, per event loop) so repeated calls keep their HTTPS connections
+alive instead of reconnecting every time.
+"""
+
+import asyncio
+import functools
+import os
+import threading
+import weakref
+
+import httpx
+import orjson
+from openai import APIError, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+
+POOL_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=20)
+
+# Fail fast on a stuck connection and retry 429s/5xx with backoff. The read
+# timeout is between chunks for streamed responses, so requests with long
+# outputs are streamed.
+REQUEST_TIMEOUT = httpx.Timeout(60, connect=5)
+MAX_RETRIES = 4
+
+# Event loop -> {api_key: AsyncOpenAI}; entries go away with their loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str | None) -> OpenAI:
+    return OpenAI(
+        api_key=api_key,
+        max_retries=MAX_RETRIES,
+        timeout=REQUEST_TIMEOUT,
+        http_client=DefaultHttpxClient(limits=POOL_LIMITS)
+    )
+
+
+def get_client(api_key: str | None = None) -> OpenAI:
+    """
+    Get a cached OpenAI client.
+
+    Args:
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+    """
+    return _get_client(api_key or os.environ.get("OPENAI_API_KEY"))
+
+
+def get_async_client(api_key: str | None = None) -> AsyncOpenAI:
+    """
+    Get a cached AsyncOpenAI client for the running event loop.
+
+    The client's connections belong to the loop that uses them, so clients
+    are cached per loop. Callers that keep their loop alive between calls
+    reuse the client's connections. Must be called from a coroutine.
+
+    Unlike get_client(), the client doesn't retry failed requests; callers
+    handle retries themselves.
+
+    Args:
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+    """
+    loop = asyncio.get_running_loop()
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if api_key not in clients:
+            # segment._complete() retries with its own backoff and rate
+            # limiting; SDK retries on top of that would multiply attempts
+            clients[api_key] = AsyncOpenAI(
+                api_key=api_key,
+                max_retries=0,
+                timeout=REQUEST_TIMEOUT,
+                http_client=DefaultAsyncHttpxClient(limits=POOL_LIMITS)
+            )
+        return clients[api_key]
+
+
+async def close_async_clients() -> None:
+    """Close the cached AsyncOpenAI clients for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.pop(loop, {})
+    for client in clients.values():
+        await client.close()
+
+
+def parse_stream_line(line: str, request: httpx.Request) -> dict | None:
+    """
+    Parse one line of a streamed chat completion.
+
+    Streamed requests go through with_streaming_response and are read line
+    by line to the end of the body, so their connection goes back to the
+    pool. The SDK's own stream iterator closes the response at [DONE],
+    before httpx has read the end of the body, which drops the connection.
+
+    Args:
+        line: A line of the server-sent event stream
+        request: The streamed request, for errors
+
+    Returns:
+        The chunk's first choice ({"delta": ..., "finish_reason": ...}), or
+        None for lines without one
+
+    Raises:
+        APIError: If the server sent an error event
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return None
+
+    chunk = orjson.loads(data)
+    if chunk.get("error"):
+        error = chunk["error"]
+        raise APIError(error.get("message", "Error in streamed response"), request, body=error)
+    if not chunk.get("choices"):
+        return None
+    return chunk["choices"][0]
@@ -6,31 +6,70 @@ Usage:
 """
 
 import argparse
-import json
+import fcntl
 import os
+import queue
+import random
 import re
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import orjson
+from yt_dlp import YoutubeDL
+
 # Add parent to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
 from monitor import fetch_latest_videos, sanitize_filename
-from transcribe import transcribe, segments_to_text
-from segment import segment_transcript, extract_sermon_segments, segments_to_text as sermon_to_text
-from cleanup import cleanup_sermon
+from ratelimit import RateLimiter, estimate_tokens
+
+# transcribe, segment and cleanup pull in faster-whisper and openai, so they
+# are imported where used; runs with nothing to process never load them.
 
 
 OUTPUT_DIR = Path(__file__).parent.parent / "output"
 JEKYLL_DIR = Path(__file__).parent.parent / "docs" / "_sermons"
 WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "small")
 GPT_MODEL = os.environ.get("GPT_MODEL", "gpt-4o-mini")
+OPENAI_WORKERS = int(os.environ.get("OPENAI_WORKERS", 8))
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))
+KEEP_INTERMEDIATE = bool(os.environ.get("KEEP_INTERMEDIATE"))
+
+# Equivalent to `yt-dlp -f bestaudio -o output/audio_<id>.%(ext)s`. The audio
+# is kept in its original container (m4a/webm); Whisper decodes it directly,
+# so there's no ffmpeg re-encode to mp3.
+DOWNLOAD_OPTS = {
+    "format": "bestaudio/best",
+    "outtmpl": str(OUTPUT_DIR / "audio_%(id)s.%(ext)s"),
+    "socket_timeout": 60,
+    "quiet": True,
+    "no_warnings": True,
+}
+
+_downloader = threading.local()
+# Every thread's YoutubeDL, so they can be closed once downloads finish
+_downloaders = []
+_downloaders_lock = threading.Lock()
+
+# Video ID -> open .lock file, held until the run finishes
+_video_locks = {}
+
+# Date formats found in video titles
+_DATE_MONTH = re.compile(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\.?\s+(\d{1,2}),?\s+(\d{4})')
+_DATE_YMD_SPACED = re.compile(r'(\d{4})\s+(\d{2})\s+(\d{2})')
+_DATE_ISO = re.compile(r'(\d{4}-\d{2}-\d{2})')
+_MONTHS = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
+           'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
+           'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
 
 
 def get_existing_sermons() -> set[str]:
-    """Get set of video IDs that already have transcripts."""
+    """Get the filename stems of all existing transcripts."""
     OUTPUT_DIR.mkdir(exist_ok=True)
 
     existing = set()
@@ -42,6 +81,29 @@ def get_existing_sermons() -> set[str]:
     return existing
 
 
+def extract_date_from_title(title: str) -> str | None:
+    """Try to extract a YYYY-MM-DD date from a video title."""
+    # Match "Jan. 18, 2026" or "Dec. 28, 2025" format
+    match = _DATE_MONTH.search(title)
+    if match:
+        month = _MONTHS[match.group(1)]
+        day = match.group(2).zfill(2)
+        year = match.group(3)
+        return f"{year}-{month}-{day}"
+
+    # Match YYYY MM DD pattern (Morning Prayer titles)
+    match = _DATE_YMD_SPACED.search(title)
+    if match:
+        return f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
+
+    # Match YYYY-MM-DD pattern
+    match = _DATE_ISO.search(title)
+    if match:
+        return match.group(1)
+
+    return None
+
+
 def generate_jekyll_post(video: dict, content: str, date_str: str) -> Path:
     """Generate a Jekyll-compatible markdown file for the sermon."""
     JEKYLL_DIR.mkdir(parents=True, exist_ok=True)
@@ -86,117 +148,365 @@ def filename_for_video(video: dict) -> str:
         return f"sermon_{title}"
 
 
-def video_has_transcript(video: dict) -> bool:
-    """Check if a video already has a transcript file."""
+def video_has_transcript(video: dict, existing: set[str]) -> bool:
+    """
+    Check if a video already has a transcript file.
+
+    Args:
+        video: Video dict from fetch_latest_videos
+        existing: Transcript stems from get_existing_sermons()
+    """
     expected = filename_for_video(video)
 
-    # Check for exact match or partial match (in case of naming variations)
-    for f in OUTPUT_DIR.glob("sermon_*.txt"):
+    # Exact match is the common case
+    if expected in existing:
+        return True
+
+    # Check for partial match (in case of naming variations)
+    for stem in existing:
         # Match by video ID in filename or by date+title
-        if video["video_id"] in f.stem or expected in f.stem:
+        if video["video_id"] in stem or expected in stem:
             return True
         # Also check if the date and a significant part of title match
-        if video.get("upload_date") and video["upload_date"] in f.stem:
-            if video.get("safe_title", "")[:20] in f.stem:
+        if video.get("upload_date") and video["upload_date"] in stem:
+            if video.get("safe_title", "")[:20] in stem:
                 return True
 
     return False
 
 
-def download_audio(url: str, output_path: Path) -> bool:
-    """Download audio from YouTube video."""
-    print(f"  Downloading audio...")
+def get_downloader() -> YoutubeDL:
+    """
+    Get this thread's YoutubeDL instance.
+
+    YoutubeDL isn't thread-safe, so each download worker keeps its own and
+    reuses it for every video that worker handles.
+    """
+    ydl = getattr(_downloader, "ydl", None)
+    if ydl is None:
+        ydl = _downloader.ydl = YoutubeDL(DOWNLOAD_OPTS)
+        with _downloaders_lock:
+            _downloaders.append(ydl)
+    return ydl
+
+
+def close_downloaders() -> None:
+    """Close every thread's YoutubeDL, saving cookies and releasing connections."""
+    with _downloaders_lock:
+        for ydl in _downloaders:
+            ydl.close()
+        _downloaders.clear()
+
+
+def download_audio(url: str) -> Path | None:
+    """Download audio from YouTube video, returning the downloaded file."""
     try:
-        result = subprocess.run(
-            [
-                "yt-dlp",
-                "-x",
-                "--audio-format", "mp3",
-                "-o", str(output_path),
-                url
-            ],
-            capture_output=True,
-            text=True,
-            timeout=600
-        )
-        if result.returncode != 0:
-            print(f"  Error: {result.stderr}")
-            return False
-        return True
+        info = get_downloader().extract_info(url, download=True)
     except Exception as e:
-        print(f"  Error downloading: {e}")
+        print(f"  Error downloading {url}: {e}")
+        return None
+
+    downloads = info.get("requested_downloads") or [{}]
+    filepath = downloads[0].get("filepath")
+    return Path(filepath) if filepath else None
+
+
+def lock_video(video: dict) -> bool:
+    """
+    Claim a video for this run.
+
+    Takes a non-blocking flock on a .lock sidecar next to the transcript, so
+    overlapping runs (e.g. the scheduled job and a manual catch-up) don't
+    download and transcribe the same video. The lock is held until
+    release_video_locks() or the process exits.
+
+    Returns True if the lock was acquired, False if another run holds it.
+    """
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    lock_file = open(OUTPUT_DIR / f"{filename_for_video(video)}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
         return False
 
+    _video_locks[video["video_id"]] = lock_file
+    return True
+
+
+def release_video_locks() -> None:
+    """Release every video lock taken by this run."""
+    # Closing the file drops the flock. The sidecar itself is left in place;
+    # unlinking it would let another run lock a file this one no longer sees.
+    for lock_file in _video_locks.values():
+        lock_file.close()
+    _video_locks.clear()
 
-def process_video(video: dict) -> bool:
-    """Process a single video through the full pipeline."""
+
+def stage_download(video: dict) -> Path | None:
+    """
+    Download a video's audio. Safe to run from a worker thread.
+
+    Returns the path to the audio file, or None if the download failed.
+    """
     video_id = video["video_id"]
-    title = video["title"]
-    url = video["url"]
 
-    print(f"\nProcessing: {title}")
-    print(f"  URL: {url}")
+    # Another run may have finished or claimed this video since we listed it
+    output_file = OUTPUT_DIR / f"{filename_for_video(video)}.txt"
+    if output_file.exists() or not lock_video(video) or output_file.exists():
+        print(f"  [SKIP] {video['title'][:50]} (handled by another run)")
+        return None
 
-    # Paths
-    audio_path = OUTPUT_DIR / "audio.mp3"
-    transcript_path = OUTPUT_DIR / "audio_transcript.json"
+    print(f"  Downloading: {video['title'][:50]}...")
 
     # 1. Download audio
-    if not download_audio(url, audio_path.with_suffix(".%(ext)s")):
-        return False
+    audio_file = download_audio(video["url"])
+    if audio_file and audio_file.exists():
+        return audio_file
+    if audio_file is not None:
+        print(f"  Error: Audio file not found after download ({video_id})")
+
+    # Remove any partial download
+    for f in OUTPUT_DIR.glob(f"audio_{video_id}.*"):
+        f.unlink(missing_ok=True)
+    return None
 
-    # Find the actual downloaded file (might have different extension initially)
-    audio_file = OUTPUT_DIR / "audio.mp3"
-    if not audio_file.exists():
-        print("  Error: Audio file not found after download")
-        return False
+
+def stage_decode(audio_file: Path):
+    """
+    Decode downloaded audio for transcription and remove the file.
+
+    Returns the decoded samples, or None if decoding failed.
+    """
+    from transcribe import load_audio
+
+    try:
+        return load_audio(audio_file)
+    except Exception as e:
+        print(f"  Error decoding audio ({audio_file.name}): {e}")
+        return None
+    finally:
+        # Cleanup temp files
+        audio_file.unlink(missing_ok=True)
+
+
+def stage_transcribe(video: dict, audio, model) -> dict | None:
+    """
+    Transcribe a video's decoded audio with a preloaded model.
+
+    Returns the Whisper result, or None if transcription failed.
+    """
+    from transcribe import transcribe_with
+
+    print(f"\nProcessing: {video['title']}")
+    print(f"  URL: {video['url']}")
 
     # 2. Transcribe
     print(f"  Transcribing with Whisper ({WHISPER_MODEL})...")
     try:
-        result = transcribe(str(audio_file), model_name=WHISPER_MODEL)
-        with open(transcript_path, "w") as f:
-            json.dump(result, f, indent=2)
+        result = transcribe_with(model, audio)
     except Exception as e:
         print(f"  Error transcribing: {e}")
-        return False
+        return None
+
+    # The result is passed on in memory; only write it out for debugging
+    if KEEP_INTERMEDIATE:
+        transcript_path = OUTPUT_DIR / f"audio_{video['video_id']}_transcript.json"
+        with open(transcript_path, "wb") as f:
+            f.write(orjson.dumps(result))
+        print(f"  Kept transcript: {transcript_path.name}")
+
+    return result
+
+
+def _submit_downloads(
+    executor: ThreadPoolExecutor,
+    videos: list[dict],
+    downloads: queue.Queue
+) -> None:
+    """Queue downloads with a short, jittered pause between each one."""
+    for i, video in enumerate(videos):
+        if i:
+            time.sleep(random.uniform(0.5, 1.5))
+        future = executor.submit(stage_download, video)
+        future.add_done_callback(
+            lambda f, video=video: downloads.put(
+                (video, None if f.exception() else f.result())
+            )
+        )
+
+
+def _decode_downloads(
+    videos: list[dict],
+    downloads: queue.Queue,
+    decoded: queue.Queue
+) -> None:
+    """Decode finished downloads, staying one video ahead of transcription."""
+    for _ in videos:
+        video, audio_file = downloads.get()
+        audio = stage_decode(audio_file) if audio_file else None
+        decoded.put((video, audio))
+
+
+def transcribe_videos(videos: list[dict]) -> list[tuple[dict, dict]]:
+    """
+    Download and transcribe videos.
+
+    Downloads run concurrently on a thread pool while transcription (CPU/GPU
+    bound) works through finished downloads one at a time. Each video's
+    audio is decoded in a background thread while the one before it is
+    transcribed.
+
+    Returns:
+        List of (video, whisper_result) tuples for videos that succeeded
+        (empty if the Whisper model fails to load)
+    """
+    from transcribe import load_model
+
+    # Load the model once for all videos, before anything is downloaded
+    try:
+        model = load_model(WHISPER_MODEL)
+    except Exception as e:
+        print(f"Error loading Whisper model ({WHISPER_MODEL}): {e}")
+        return []
+
+    downloads = queue.Queue()
+    # Decoded audio is large (~230 MB per hour), so only keep one waiting
+    decoded = queue.Queue(maxsize=1)
+    transcribed = []
 
-    # 3. Segment
-    print(f"  Segmenting with GPT ({GPT_MODEL})...")
     try:
-        formatted = segments_to_text(result["segments"], include_timestamps=True)
-        boundaries = segment_transcript(formatted, model=GPT_MODEL)
-
-        if not boundaries.get("sermon_start") or not boundaries.get("sermon_end"):
-            reason = boundaries.get('reasoning', 'Unknown reason')
-            print(f"  No sermon found: {reason}")
-            # Save placeholder file so we don't reprocess this video
-            filename = filename_for_video(video)
-            output_file = OUTPUT_DIR / f"{filename}.txt"
-            with open(output_file, "w") as f:
-                f.write(f"[NO SERMON FOUND]\n\n{reason}")
-            print(f"  Saved placeholder: {output_file.name}")
-            return False
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            producer = threading.Thread(
+                target=_submit_downloads,
+                args=(executor, videos, downloads),
+                daemon=True
+            )
+            producer.start()
+            decoder = threading.Thread(
+                target=_decode_downloads,
+                args=(videos, downloads, decoded),
+                daemon=True
+            )
+            decoder.start()
+
+            for _ in videos:
+                video, audio = decoded.get()
+                if audio is None:
+                    continue
+                result = stage_transcribe(video, audio, model)
+                if result:
+                    transcribed.append((video, result))
+
+            producer.join()
+            decoder.join()
+    finally:
+        # The download pool has shut down, so its downloaders are done
+        close_downloaders()
+
+    return transcribed
+
+
+def save_placeholder(video: dict, reason: str) -> None:
+    """Save a placeholder transcript so a video without a sermon isn't reprocessed."""
+    filename = filename_for_video(video)
+    output_file = OUTPUT_DIR / f"{filename}.txt"
+    with open(output_file, "w") as f:
+        f.write(f"[NO SERMON FOUND]\n\n{reason}")
+    print(f"  [{video['title'][:50]}] Saved placeholder: {output_file.name}")
+
+
+def stage_segment_cleanup(video: dict, result: dict, limiter: RateLimiter) -> str | None:
+    """
+    Find and clean up the sermon in a transcribed video.
 
+    Uses a single combined request, falling back to separate segment and
+    cleanup requests if that fails (e.g. the response was truncated). Safe
+    to run from a worker thread.
+
+    Returns the cleaned sermon text, or None if it failed or there is no
+    sermon.
+    """
+    from transcribe import Segments, segments_to_text
+    from segment import segment_transcript, extract_sermon_segments, segments_to_text as sermon_to_text
+    from cleanup import cleanup_sermon, segment_and_cleanup
+
+    label = video["title"][:50]
+    # Column-wise, since the segments are formatted and may be searched again
+    segments = Segments.from_dicts(result["segments"])
+    formatted = segments_to_text(segments, include_timestamps=True)
+
+    # 3-4. Segment and clean up
+    try:
+        limiter.acquire(estimate_tokens(formatted))
+        response = segment_and_cleanup(formatted, model=GPT_MODEL)
+    except Exception as e:
+        print(f"  [{label}] Combined request failed, segmenting separately: {e}")
+        try:
+            response = segment_transcript(formatted, model=GPT_MODEL, limiter=limiter)
+        except Exception as e:
+            print(f"  [{label}] Error segmenting: {e}")
+            return None
+
+    if not response.get("sermon_start") or not response.get("sermon_end"):
+        reason = response.get('reasoning', 'Unknown reason')
+        print(f"  [{label}] No sermon found: {reason}")
+        save_placeholder(video, reason)
+        return None
+
+    print(f"  [{label}] Found sermon: {response['sermon_start']} - {response['sermon_end']}")
+    if response.get("cleaned_text"):
+        return response["cleaned_text"]
+
+    # Only boundaries came back: extract the sermon and clean it up on its own
+    try:
         sermon_segments = extract_sermon_segments(
-            result["segments"],
-            boundaries["sermon_start"],
-            boundaries["sermon_end"]
+            segments,
+            response["sermon_start"],
+            response["sermon_end"]
         )
         sermon_text = sermon_to_text(sermon_segments)
-        print(f"  Found sermon: {boundaries['sermon_start']} - {boundaries['sermon_end']}")
+        limiter.acquire(estimate_tokens(sermon_text))
+        return cleanup_sermon(sermon_text, model=GPT_MODEL)
     except Exception as e:
-        print(f"  Error segmenting: {e}")
-        return False
+        print(f"  [{label}] Error cleaning: {e}")
+        return None
 
-    # 4. Cleanup
-    print(f"  Cleaning up transcript...")
-    try:
-        cleaned = cleanup_sermon(sermon_text, model=GPT_MODEL)
-    except Exception as e:
-        print(f"  Error cleaning: {e}")
-        return False
 
+def process_transcripts(transcribed: list[tuple[dict, dict]]) -> list[tuple[dict, str]]:
+    """
+    Segment and clean up transcribed videos using concurrent OpenAI requests.
+
+    Args:
+        transcribed: List of (video, whisper_result) tuples
+
+    Returns:
+        List of (video, cleaned_text) tuples for videos that succeeded
+    """
+    from segment import close_event_loops
+
+    limiter = RateLimiter.from_env()
+    results = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=OPENAI_WORKERS) as executor:
+            futures = {
+                executor.submit(stage_segment_cleanup, video, result, limiter): video
+                for video, result in transcribed
+            }
+            for future in as_completed(futures):
+                cleaned = future.result()
+                if cleaned:
+                    results.append((futures[future], cleaned))
+    finally:
+        # The worker pool has shut down, so its event loops are idle
+        close_event_loops()
+
+    return results
+
+
+def save_sermon(video: dict, cleaned: str) -> Path:
+    """Save a cleaned sermon and its Jekyll page, returning the output path."""
     # 5. Save output
     filename = filename_for_video(video)
     output_file = OUTPUT_DIR / f"{filename}.txt"
@@ -211,28 +521,15 @@ def process_video(video: dict) -> bool:
     upload_date = video.get("upload_date", "")
     if not upload_date or upload_date == "NA":
         # Try to extract from title
-        title = video.get("title", "")
-        match = re.search(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\.?\s+(\d{1,2}),?\s+(\d{4})', title)
-        if match:
-            month_map = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
-                         'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
-                         'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
-            month = month_map[match.group(1)]
-            day = match.group(2).zfill(2)
-            year = match.group(3)
-            upload_date = f"{year}-{month}-{day}"
-        else:
-            upload_date = datetime.now().strftime("%Y-%m-%d")
+        upload_date = (
+            extract_date_from_title(video.get("title", ""))
+            or datetime.now().strftime("%Y-%m-%d")
+        )
 
     jekyll_file = generate_jekyll_post(video, cleaned, upload_date)
     print(f"  Jekyll: {jekyll_file.name}")
 
-    # Cleanup temp files
-    audio_file.unlink(missing_ok=True)
-    transcript_path.unlink(missing_ok=True)
-    (OUTPUT_DIR / "audio_sermon.json").unlink(missing_ok=True)
-
-    return True
+    return output_file
 
 
 def git_push(files: list[Path], message: str) -> bool:
@@ -299,31 +596,6 @@ def main():
     cutoff = datetime.now() - timedelta(days=args.days)
     cutoff_str = cutoff.strftime("%Y-%m-%d")
 
-    def extract_date_from_title(title: str) -> str | None:
-        """Try to extract date from title."""
-        # Match "Jan. 18, 2026" or "Dec. 28, 2025" format
-        match = re.search(r'(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\.?\s+(\d{1,2}),?\s+(\d{4})', title)
-        if match:
-            month_map = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04',
-                         'May': '05', 'Jun': '06', 'Jul': '07', 'Aug': '08',
-                         'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
-            month = month_map[match.group(1)]
-            day = match.group(2).zfill(2)
-            year = match.group(3)
-            return f"{year}-{month}-{day}"
-
-        # Match YYYY MM DD pattern (Morning Prayer titles)
-        match = re.search(r'(\d{4})\s+(\d{2})\s+(\d{2})', title)
-        if match:
-            return f"{match.group(1)}-{match.group(2)}-{match.group(3)}"
-
-        # Match YYYY-MM-DD pattern
-        match = re.search(r'(\d{4}-\d{2}-\d{2})', title)
-        if match:
-            return match.group(1)
-
-        return None
-
     recent_videos = []
     for v in videos:
         upload_date = v.get("upload_date", "")
@@ -341,7 +613,7 @@ def main():
     print(f"Found {len(recent_videos)} videos in the last {args.days} days")
 
     # Find videos without transcripts
-    OUTPUT_DIR.mkdir(exist_ok=True)
+    existing = get_existing_sermons()
     to_process = []
 
     for video in recent_videos:
@@ -352,7 +624,7 @@ def main():
             print(f"  [SKIP] {title[:50]}... (daily/morning video)")
             continue
 
-        if video_has_transcript(video):
+        if video_has_transcript(video, existing):
             print(f"  [SKIP] {title[:50]}... (already has transcript)")
         else:
             print(f"  [NEW]  {title[:50]}...")
@@ -370,13 +642,19 @@ def main():
             print(f"  - {v['title']}")
         sys.exit(0)
 
-    # Process each video
     processed_files = []
-    for video in to_process:
-        success = process_video(video)
-        if success:
-            filename = filename_for_video(video)
-            processed_files.append(OUTPUT_DIR / f"{filename}.txt")
+    try:
+        # Download concurrently, transcribe each video as its audio arrives
+        transcribed = transcribe_videos(to_process)
+
+        # Segment and clean up concurrently (network bound), then save each one
+        if transcribed:
+            print(f"\nSegmenting and cleaning up {len(transcribed)} transcript(s) with GPT ({GPT_MODEL})...")
+            for video, cleaned in process_transcripts(transcribed):
+                print(f"\n{video['title']}")
+                processed_files.append(save_sermon(video, cleaned))
+    finally:
+        release_video_locks()
 
     print(f"\n{'='*60}")
     print(f"Processed {len(processed_files)} of {len(to_process)} videos")
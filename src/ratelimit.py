@@ -0,0 +1,85 @@
+"""
+Rate limiting for OpenAI requests.
+
+Keeps concurrent segmentation/cleanup calls under the account's
+requests-per-minute and tokens-per-minute limits.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket for requests and tokens per minute.
+
+    Both buckets start full and refill continuously, so short bursts are
+    allowed up to the per-minute capacity.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Build a limiter from OPENAI_MAX_RPM / OPENAI_MAX_TPM (tier 1 defaults)."""
+        return cls(
+            requests_per_minute=float(os.environ.get("OPENAI_MAX_RPM", 500)),
+            tokens_per_minute=float(os.environ.get("OPENAI_MAX_TPM", 200_000))
+        )
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute / 60
+        )
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take one request and the tokens if available; otherwise return the wait."""
+        # A request bigger than the whole bucket would otherwise wait forever
+        tokens = min(tokens, self.tokens_per_minute)
+
+        with self._lock:
+            self._refill()
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0
+            return max(
+                (1 - self._requests) * 60 / self.requests_per_minute,
+                (tokens - self._tokens) * 60 / self.tokens_per_minute
+            )
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Block until one request using the given number of tokens is allowed.
+
+        Args:
+            tokens: Estimated tokens the request will consume
+        """
+        while wait := self._try_acquire(tokens):
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """Like acquire(), but waits without blocking the event loop."""
+        while wait := self._try_acquire(tokens):
+            await asyncio.sleep(wait)
@@ -5,20 +5,29 @@ Analyzes a timestamped transcript to identify sermon boundaries
 within a church service recording.
 """
 
-import os
-import json
+import asyncio
+import bisect
+import random
+import re
+import threading
 from pathlib import Path
 
+import httpx
+import numpy as np
+import openai
+import orjson
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from cache import cache_get, cache_key, cache_put
+from openai_client import close_async_clients, get_async_client, parse_stream_line
+from ratelimit import RateLimiter, estimate_tokens
 
 # Load .env from project root
 load_dotenv(Path(__file__).parent.parent / ".env")
 
 
-SYSTEM_PROMPT = """You are an assistant that analyzes church service transcripts to identify the sermon portion.
-
-A typical church service includes:
+# How to recognise the sermon; shared with the combined segment + cleanup prompt
+SERVICE_DESCRIPTION = """A typical church service includes:
 - Welcome/announcements
 - Worship music/singing
 - Prayer
@@ -31,30 +40,69 @@ The sermon is usually:
 - The longest continuous section of teaching by one speaker
 - Contains scripture references and exposition
 - Has a teaching/preaching tone
-- Usually 20-45 minutes long
+- Usually 20-45 minutes long"""
+
+SYSTEM_PROMPT = f"""You are an assistant that analyzes church service transcripts to identify the sermon portion.
+
+{SERVICE_DESCRIPTION}
 
 Analyze the provided transcript and identify where the sermon begins and ends.
 Return your response as JSON with this exact format:
-{
+{{
   "sermon_start": "HH:MM:SS",
   "sermon_end": "HH:MM:SS",
   "confidence": "high|medium|low",
   "reasoning": "Brief explanation of why you identified these boundaries"
-}
+}}
 
 If you cannot identify a clear sermon, return:
-{
+{{
   "sermon_start": null,
   "sermon_end": null,
   "confidence": "low",
   "reasoning": "Explanation of why sermon could not be identified"
-}"""
+}}"""
+
+
+WINDOW_SUMMARY_PROMPT = f"""You are an assistant that summarizes excerpts of church service transcripts.
+
+{SERVICE_DESCRIPTION}
+
+You will be given one excerpt of a timestamped transcript. Reply with a single line in this format:
+[HH:MM:SS - HH:MM:SS] Two-sentence gist of the excerpt
+
+Use the first and last timestamps of the excerpt. Say which part of the service it is (e.g. announcements, worship, scripture reading, sermon) and, if that changes within the excerpt, the timestamp where it changes."""
+
+_LINE_TIMESTAMP = re.compile(r"\[(\d+):(\d{2}):(\d{2})\]")
+_TIMESTAMP = re.compile(r"(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d+)?)")
+
+# Characters allowed after a streamed JSON object before the stream is cut off
+MAX_TRAILING_CHARS = 200
+
+# Per-thread event loops for running the async requests; see _run()
+_thread_state = threading.local()
+_loops = []
+_loops_lock = threading.Lock()
+
+# Shared by all calls that aren't given a limiter, so they throttle together
+_limiter = RateLimiter.from_env()
+
+# Errors worth retrying: rate limits, timeouts, dropped connections, 5xx
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    # Raised unwrapped when a connection drops mid-stream
+    httpx.TransportError,
+)
 
 
 def segment_transcript(
     transcript_text: str,
     model: str = "gpt-4o-mini",
-    api_key: str | None = None
+    api_key: str | None = None,
+    use_cache: bool = True,
+    limiter: RateLimiter | None = None
 ) -> dict:
     """
     Identify sermon boundaries in a transcript.
@@ -63,26 +111,405 @@ def segment_transcript(
         transcript_text: Timestamped transcript text
         model: OpenAI model to use
         api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        use_cache: Reuse a previous result for the same transcript and model
+        limiter: Rate limiter to throttle the request with (defaults to one
+            shared by all segmentation calls)
 
     Returns:
         dict with sermon_start, sermon_end, confidence, reasoning
     """
-    client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+    return segment_transcripts_batch(
+        [transcript_text], model=model, api_key=api_key, use_cache=use_cache, limiter=limiter
+    )[0]
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
+
+def segment_transcripts_batch(
+    transcripts: list[str],
+    model: str = "gpt-4o-mini",
+    api_key: str | None = None,
+    max_concurrent: int = 10,
+    max_requests_per_minute: float | None = None,
+    max_tokens_per_minute: float | None = None,
+    max_attempts: int = 5,
+    use_cache: bool = True,
+    limiter: RateLimiter | None = None
+) -> list[dict]:
+    """
+    Identify sermon boundaries in several transcripts concurrently.
+
+    Requests run in parallel, throttled to the account's rate limits, and
+    are retried with exponential backoff on rate limit and server errors.
+    Each result is cached as soon as it arrives, so if the batch fails,
+    re-running it only sends the transcripts that didn't finish.
+
+    Must not be called from a running event loop.
+
+    Args:
+        transcripts: Timestamped transcript texts
+        model: OpenAI model to use
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        max_concurrent: Maximum requests in flight at once
+        max_requests_per_minute: Request rate limit (defaults to OPENAI_MAX_RPM)
+        max_tokens_per_minute: Token rate limit (defaults to OPENAI_MAX_TPM)
+        max_attempts: Attempts per transcript before giving up
+        use_cache: Reuse previous results for the same transcript and model
+        limiter: Rate limiter to throttle requests with, e.g. one shared
+            with other OpenAI calls. Without one, requests share a limiter
+            with all other segmentation calls, unless either rate limit is
+            given, in which case this batch gets a limiter of its own.
+
+    Returns:
+        Segmentation results (see segment_transcript()), in the same order
+        as transcripts
+    """
+    if limiter is None:
+        if max_requests_per_minute or max_tokens_per_minute:
+            limiter = RateLimiter(
+                requests_per_minute=max_requests_per_minute or _limiter.requests_per_minute,
+                tokens_per_minute=max_tokens_per_minute or _limiter.tokens_per_minute
+            )
+        else:
+            limiter = _limiter
+
+    return _run(_segment_all(
+        transcripts, model, api_key, max_concurrent, limiter, max_attempts, use_cache
+    ))
+
+
+def _run(coro):
+    # Run on this thread's event loop. The loop is kept between calls so
+    # its cached AsyncOpenAI client (and connections) are reused.
+    loop = getattr(_thread_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _thread_state.loop = asyncio.new_event_loop()
+        with _loops_lock:
+            _loops.append(loop)
+    return loop.run_until_complete(coro)
+
+
+async def _gather(*aws):
+    # Like asyncio.gather(), but if one fails the rest are cancelled and
+    # awaited. Otherwise they stay pending on the thread's loop and resume,
+    # sending requests, during its next _run().
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def close_event_loops() -> None:
+    """
+    Close the event loops segmentation calls ran on, and their OpenAI clients.
+
+    Call once no segmentation calls are running, e.g. after the worker pool
+    that made them has shut down. Later calls start new loops.
+    """
+    with _loops_lock:
+        loops = _loops[:]
+        _loops.clear()
+    for loop in loops:
+        loop.run_until_complete(close_async_clients())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def _segment_all(
+    transcripts: list[str],
+    model: str,
+    api_key: str | None,
+    max_concurrent: int,
+    limiter: RateLimiter,
+    max_attempts: int,
+    use_cache: bool
+) -> list[dict]:
+    semaphore = asyncio.Semaphore(max_concurrent)
+    client = get_async_client(api_key)
+    return await _gather(*(
+        _segment_one(client, text, model, semaphore, limiter, max_attempts, use_cache)
+        for text in transcripts
+    ))
+
+
+async def _segment_one(
+    client: openai.AsyncOpenAI,
+    transcript_text: str,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    max_attempts: int,
+    use_cache: bool
+) -> dict:
+    key = cache_key(model, SYSTEM_PROMPT, transcript_text)
+    if use_cache:
+        cached = cache_get("segment", key, suffix=".json")
+        if cached is not None:
+            return orjson.loads(cached)
+
+    content = await _complete(
+        client,
+        [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": f"Here is the church service transcript:\n\n{transcript_text}"}
         ],
+        semaphore, limiter, max_attempts,
+        model=model,
         response_format={"type": "json_object"},
         temperature=0.1
     )
 
-    result = json.loads(response.choices[0].message.content)
+    result = orjson.loads(content)
+    if use_cache:
+        cache_put("segment", key, content, suffix=".json")
     return result
 
 
+async def _complete(
+    client: openai.AsyncOpenAI,
+    messages: list[dict],
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    max_attempts: int,
+    **kwargs
+) -> str:
+    # One rate-limited chat completion, retried with exponential backoff
+    tokens = sum(estimate_tokens(m["content"]) for m in messages)
+    async with semaphore:
+        for attempt in range(max_attempts):
+            await limiter.acquire_async(tokens)
+            try:
+                json_mode = kwargs.get("response_format", {}).get("type") == "json_object"
+                async with client.chat.completions.with_streaming_response.create(
+                    messages=messages, stream=True, **kwargs
+                ) as response:
+                    return await _read_stream(response, stop_after_object=json_mode)
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_attempts - 1:
+                    raise
+                delay = min(60, 2 ** attempt) + random.random()
+                print(f"  Segmentation request failed ({e.__class__.__name__}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+
+
+async def _read_stream(response, stop_after_object: bool) -> str:
+    # Collect a streamed completion (see parse_stream_line()). For JSON
+    # responses, anything after the top-level object is dropped, and the
+    # stream is cut off if that tail runs on: in JSON mode the model
+    # sometimes pads the object with whitespace until it reaches the token
+    # limit. Otherwise the body is read to the end, so the connection goes
+    # back to the pool.
+    parts = []
+    scanner = _JSONObjectScanner() if stop_after_object else None
+    trailing = None
+    async for line in response.iter_lines():
+        choice = parse_stream_line(line, response.http_request)
+        if choice is None:
+            continue
+        piece = choice["delta"].get("content") or ""
+        if trailing is not None:
+            trailing += len(piece)
+            if trailing > MAX_TRAILING_CHARS:
+                break
+            continue
+        end = scanner.feed(piece) if scanner else None
+        if end is not None:
+            parts.append(piece[:end])
+            trailing = len(piece) - end
+            continue
+        parts.append(piece)
+
+    return "".join(parts)
+
+
+class _JSONObjectScanner:
+    """Finds where a streamed JSON object ends, ignoring braces in strings."""
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, text: str) -> int | None:
+        """Scan the next piece of text; return the index just past the closing brace, if it's in it."""
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    return i + 1
+        return None
+
+
+def split_into_windows(
+    transcript_text: str,
+    window_seconds: float,
+    overlap_seconds: float
+) -> list[str]:
+    """
+    Split a timestamped transcript into overlapping time windows.
+
+    Args:
+        transcript_text: Transcript with one "[HH:MM:SS] text" line per segment
+        window_seconds: Length of each window
+        overlap_seconds: Overlap between consecutive windows
+
+    Returns:
+        Transcript text for each window, in order
+    """
+    if overlap_seconds >= window_seconds:
+        raise ValueError("overlap must be shorter than the window")
+
+    times = []
+    lines = []
+    for line in transcript_text.splitlines():
+        match = _LINE_TIMESTAMP.match(line)
+        if match:
+            h, m, sec = match.groups()
+            times.append(int(h) * 3600 + int(m) * 60 + int(sec))
+            lines.append(line)
+        elif lines:
+            # Untimestamped continuation of the previous segment
+            lines[-1] += "\n" + line
+    if not lines:
+        return [transcript_text]
+
+    windows = []
+    step = window_seconds - overlap_seconds
+    window_start = 0
+    while window_start <= times[-1]:
+        i = bisect.bisect_left(times, window_start)
+        j = bisect.bisect_left(times, window_start + window_seconds)
+        if i < j:
+            windows.append("\n".join(lines[i:j]))
+        window_start += step
+
+    return windows
+
+
+def segment_transcript_mapreduce(
+    transcript_text: str,
+    model: str = "gpt-4o-mini",
+    api_key: str | None = None,
+    window_minutes: float = 10,
+    overlap: float = 60,
+    max_concurrent: int = 10,
+    max_attempts: int = 5,
+    use_cache: bool = True,
+    limiter: RateLimiter | None = None
+) -> dict:
+    """
+    Identify sermon boundaries from per-window summaries of a transcript.
+
+    Each window of the service is summarized in parallel (map), then the
+    boundaries are picked from the short summaries (reduce). This sends far
+    fewer tokens to the boundary prompt than segment_transcript(), at the
+    cost of relying on the summaries to pinpoint where the sermon starts and
+    ends. Transcripts that fit in one window go to segment_transcript().
+
+    Args:
+        transcript_text: Timestamped transcript text
+        model: OpenAI model to use
+        api_key: OpenAI API key (defaults to OPENAI_API_KEY env var)
+        window_minutes: Length of each summarized window
+        overlap: Seconds of overlap between consecutive windows, so a
+            boundary near the edge of a window is seen in context
+        max_concurrent: Maximum summary requests in flight at once
+        max_attempts: Attempts per request before giving up
+        use_cache: Reuse previous results for the same text and model
+        limiter: Rate limiter to throttle requests with (defaults to one
+            shared by all segmentation calls)
+
+    Returns:
+        dict with sermon_start, sermon_end, confidence, reasoning
+    """
+    windows = split_into_windows(transcript_text, window_minutes * 60, overlap)
+    if len(windows) <= 1:
+        return segment_transcript(
+            transcript_text, model=model, api_key=api_key, use_cache=use_cache, limiter=limiter
+        )
+
+    return _run(_segment_mapreduce(
+        windows, model, api_key, max_concurrent, limiter or _limiter, max_attempts, use_cache
+    ))
+
+
+async def _segment_mapreduce(
+    windows: list[str],
+    model: str,
+    api_key: str | None,
+    max_concurrent: int,
+    limiter: RateLimiter,
+    max_attempts: int,
+    use_cache: bool
+) -> dict:
+    semaphore = asyncio.Semaphore(max_concurrent)
+    client = get_async_client(api_key)
+    summaries = await _gather(*(
+        _summarize_window(client, window, model, semaphore, limiter, max_attempts, use_cache)
+        for window in windows
+    ))
+    summary_text = "\n".join(summaries)
+    return await _segment_one(
+        client,
+        f"(Condensed: each line summarizes one window of the service.)\n\n{summary_text}",
+        model, semaphore, limiter, max_attempts, use_cache
+    )
+
+
+async def _summarize_window(
+    client: openai.AsyncOpenAI,
+    window_text: str,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    limiter: RateLimiter,
+    max_attempts: int,
+    use_cache: bool
+) -> str:
+    key = cache_key(model, WINDOW_SUMMARY_PROMPT, window_text)
+    if use_cache:
+        cached = cache_get("segment_window", key)
+        if cached is not None:
+            return cached
+
+    summary = await _complete(
+        client,
+        [
+            {"role": "system", "content": WINDOW_SUMMARY_PROMPT},
+            {"role": "user", "content": window_text}
+        ],
+        semaphore, limiter, max_attempts,
+        model=model,
+        temperature=0.1
+    )
+
+    summary = " ".join(summary.split())
+    if use_cache:
+        cache_put("segment_window", key, summary)
+    return summary
+
+
+def _timestamp_to_seconds(ts: str) -> float:
+    # HH:MM:SS, MM:SS or SS, with optional fractional seconds
+    match = _TIMESTAMP.fullmatch(ts.strip())
+    if not match:
+        raise ValueError(f"Invalid timestamp: {ts!r}")
+    h, m, sec = match.groups()
+    return int(h or 0) * 3600 + int(m or 0) * 60 + float(sec)
+
+
 def extract_sermon_segments(
     segments: list,
     start_time: str,
@@ -92,26 +519,34 @@ def extract_sermon_segments(
     Extract segments that fall within the sermon boundaries.
 
     Args:
-        segments: List of transcript segments with start, end, text
+        segments: List of transcript segments with start, end, text, or
+            transcribe.Segments
         start_time: Sermon start timestamp (HH:MM:SS)
         end_time: Sermon end timestamp (HH:MM:SS)
 
     Returns:
-        List of segments within the sermon boundaries
+        Segments within the sermon boundaries, in the same form as segments
     """
-    def timestamp_to_seconds(ts: str) -> float:
-        parts = ts.split(":")
-        if len(parts) == 3:
-            h, m, s = parts
-            return int(h) * 3600 + int(m) * 60 + float(s)
-        elif len(parts) == 2:
-            m, s = parts
-            return int(m) * 60 + float(s)
-        else:
-            return float(parts[0])
+    start_sec = _timestamp_to_seconds(start_time)
+    end_sec = _timestamp_to_seconds(end_time)
+
+    if hasattr(segments, "starts"):
+        # transcribe.Segments already holds the times as arrays
+        starts = segments.starts
+        ends = segments.ends
+    else:
+        starts = np.fromiter((seg["start"] for seg in segments), dtype=np.float64, count=len(segments))
+        ends = np.fromiter((seg["end"] for seg in segments), dtype=np.float64, count=len(segments))
+
+    # Whisper emits segments in order, so the sermon is one contiguous run
+    # that binary search can find; anything else gets the full scan.
+    if np.all(starts[1:] >= starts[:-1]) and np.all(ends[1:] >= ends[:-1]):
+        i = int(np.searchsorted(starts, start_sec, side="left"))
+        j = int(np.searchsorted(ends, end_sec, side="right"))
+        return segments[i:j]
 
-    start_sec = timestamp_to_seconds(start_time)
-    end_sec = timestamp_to_seconds(end_time)
+    if hasattr(segments, "starts"):
+        return segments[(starts >= start_sec) & (ends <= end_sec)]
 
     sermon_segments = [
         seg for seg in segments
@@ -122,7 +557,9 @@ def extract_sermon_segments(
 
 
 def segments_to_text(segments: list) -> str:
-    """Convert segments to plain text."""
+    """Convert segments (a list of dicts or transcribe.Segments) to plain text."""
+    if hasattr(segments, "texts"):
+        return " ".join(segments.texts)
     return " ".join(seg["text"] for seg in segments)
 
 
@@ -139,8 +576,8 @@ if __name__ == "__main__":
     model = sys.argv[2] if len(sys.argv) > 2 else "gpt-4o-mini"
 
     # Load transcript
-    with open(transcript_file) as f:
-        data = json.load(f)
+    with open(transcript_file, "rb") as f:
+        data = orjson.loads(f.read())
 
     # Format transcript with timestamps for analysis
     from transcribe import segments_to_text as format_segments
@@ -176,8 +613,8 @@ if __name__ == "__main__":
             "text": sermon_text
         }
         output_file = transcript_file.replace("_transcript.json", "_sermon.json")
-        with open(output_file, "w") as f:
-            json.dump(output, f, indent=2)
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
         print(f"\nSermon saved to: {output_file}")
     else:
         print("\n" + "=" * 60)